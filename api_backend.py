@@ -1,12 +1,24 @@
+import os
+import json
+import time
 import uuid
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from llm import generate_with_groq
-from rag_manager import get_rag_manager
+from rag_manager import get_rag_manager, load_rag_manager, is_rag_ready, get_rag_load_error, RetrievalFilters
 from session_manager import get_session_manager
 from rag_utils import extract_text_from_file, smart_chunk_text
+from batch_ask import parse_questions, iter_batch_answers, DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY
+
+# Hard cap on the per-request LLM concurrency a client may ask for.
+MAX_BATCH_CONCURRENCY = 16
+
+# When enabled, the worker starts serving immediately and loads the model and
+# index in the background; /ready reports 503 until the warm-up has finished.
+FAST_START = os.getenv("FAST_START", "false").lower() in ("1", "true", "yes")
 
 app = FastAPI(title="AI Lawyer API", version="5.1.0") # Version Bump
 
@@ -20,29 +32,63 @@ app.add_middleware(
 
 @app.on_event("startup")
 def startup_event():
-    get_rag_manager()
     get_session_manager()
+    load_rag_manager(background=FAST_START)
+
+def require_ready():
+    """Rejects requests that need the RAG manager until it has warmed up."""
+    if not is_rag_ready():
+        raise HTTPException(status_code=503, detail="Service is starting up. Please retry shortly.")
 
 class QuestionRequest(BaseModel):
     question: str
     session_id: Optional[str] = None
     chat_history: List[Dict[str, str]] = []
+    filters: Optional[RetrievalFilters] = None
+
+class ShardInfoRequest(BaseModel):
+    collection: Optional[str] = None
+    jurisdiction: Optional[str] = None
+    year: Optional[int] = None
 
 class SessionRequest(BaseModel):
     session_id: str
 
+@app.get("/health", tags=["Health"])
+def health():
+    """
+    Liveness probe: the process is up and serving HTTP. Fails once the model
+    load has failed, so the orchestrator restarts a worker that can never serve.
+    """
+    error = get_rag_load_error()
+    if error:
+        raise HTTPException(status_code=500, detail=f"Model loading failed: {error}")
+    return {"status": "ok"}
+
+@app.get("/ready", tags=["Health"])
+def ready():
+    """Readiness probe: the embedding model and index are loaded and warmed up."""
+    if not is_rag_ready():
+        error = get_rag_load_error()
+        detail = f"Model loading failed: {error}" if error else "Model is still loading."
+        raise HTTPException(status_code=503, detail=detail)
+    return {"status": "ready", "vector_count": get_rag_manager().total_vectors}
+
 @app.post("/ask", tags=["AI"])
 def ask_question(req: QuestionRequest):
     question = req.question.strip()
     if not question:
         raise HTTPException(status_code=400, detail="Question cannot be empty.")
-    
+    require_ready()
+
     try:
         rag_manager = get_rag_manager()
         session_manager = get_session_manager()
 
         # Retrieve now returns a list of dictionaries with source info
-        retrieved_chunks = rag_manager.retrieve(question, top_k=10)
+        # Filters select which shards are searched, so out-of-scope sources never compete
+        filters = req.filters.model_dump(exclude_none=True) if req.filters else None
+        retrieved_chunks = rag_manager.retrieve(question, top_k=10, filters=filters)
         
         temp_chunks = []
         if req.session_id:
@@ -58,23 +104,87 @@ def ask_question(req: QuestionRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/ask-batch", tags=["AI"])
+async def ask_batch(
+    file: UploadFile = File(...),
+    top_k: int = Form(10, ge=1),
+    concurrency: int = Form(DEFAULT_CONCURRENCY, ge=1),
+):
+    """
+    Answers a JSONL file of questions. Results stream back as JSONL, one line
+    per question as it completes, followed by a final {"summary": ...} line.
+    Failed questions carry an "error" field and can be resubmitted.
+    """
+    require_ready()
+    try:
+        content = await file.read()
+        items = parse_questions(content.decode("utf-8").splitlines())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSONL: {e}")
+    concurrency = min(concurrency, MAX_BATCH_CONCURRENCY)
+
+    def stream():
+        started = time.perf_counter()
+        failed = 0
+        for result in iter_batch_answers(items, top_k=top_k, batch_size=DEFAULT_BATCH_SIZE, concurrency=concurrency):
+            failed += "error" in result
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        elapsed = time.perf_counter() - started
+        summary = {
+            "total": len(items),
+            "answered": len(items) - failed,
+            "failed": failed,
+            "elapsed_seconds": round(elapsed, 2),
+            "questions_per_second": round(len(items) / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/upload-permanent", tags=["Knowledge Base"])
-async def upload_document_permanent(file: UploadFile = File(...)):
+async def upload_document_permanent(
+    file: UploadFile = File(...),
+    collection: Optional[str] = Form(None),
+    jurisdiction: Optional[str] = Form(None),
+    year: Optional[int] = Form(None),
+):
     if not file.filename.lower().endswith(('.pdf', '.txt')):
         raise HTTPException(status_code=400, detail="Unsupported file type.")
+    require_ready()
     try:
         rag_manager = get_rag_manager()
         content = await file.read()
         # The manager now handles associating the filename with the content
-        rag_manager.add_document(content, file.filename)
+        rag_manager.add_document(content, file.filename, collection=collection, jurisdiction=jurisdiction, year=year)
         return {
             "filename": file.filename,
             "message": "File processed and permanently added.",
-            "vector_count": rag_manager.index.ntotal
+            "vector_count": rag_manager.total_vectors
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/shards", tags=["Knowledge Base"])
+def list_shards():
+    require_ready()
+    return {"shards": get_rag_manager().list_shards()}
+
+@app.patch("/shards/{shard_name}", tags=["Knowledge Base"])
+def update_shard(shard_name: str, req: ShardInfoRequest):
+    require_ready()
+    rag_manager = get_rag_manager()
+    if not rag_manager.update_shard_info(shard_name, **req.model_dump()):
+        raise HTTPException(status_code=404, detail=f"Shard '{shard_name}' not found.")
+    return {"message": f"Shard '{shard_name}' updated."}
+
+@app.delete("/shards/{shard_name}", tags=["Knowledge Base"])
+def delete_shard(shard_name: str):
+    require_ready()
+    rag_manager = get_rag_manager()
+    if not rag_manager.delete_shard(shard_name):
+        raise HTTPException(status_code=404, detail=f"Shard '{shard_name}' not found.")
+    return {"message": f"Shard '{shard_name}' deleted.", "vector_count": rag_manager.total_vectors}
+
 @app.post("/upload-temp", tags=["Knowledge Base"])
 async def upload_document_temp(file: UploadFile = File(...)):
     if not file.filename.lower().endswith(('.pdf', '.txt')):
@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from llm import generate_with_groq
+from rag_manager import get_rag_manager, RetrievalFilters
+
+# Questions are embedded and searched this many at a time.
+DEFAULT_BATCH_SIZE = 64
+# Upper bound on simultaneous LLM calls, to stay within Groq rate limits.
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TOP_K = 10
+# Input lines may use any of these keys; the first one present wins.
+ID_FIELDS = ("id", "request_id")
+QUESTION_FIELDS = ("question", "body")
+
+
+def parse_questions(lines: Iterable[str]) -> List[Dict]:
+    """
+    Parses JSONL lines into question items of the form
+    {"id": str, "question": str, "filters": dict | None}.
+    Lines without an id get "q-<hash>" derived from the question and filters,
+    so the id does not change when lines are added or reordered. Blank lines
+    are skipped; malformed records, invalid filters and duplicate ids raise
+    ValueError with the line number.
+    """
+    items = []
+    seen_ids = set()
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {line_no} is not valid JSON: {e}")
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {line_no} must be a JSON object.")
+
+        question = next((record[k] for k in QUESTION_FIELDS if record.get(k)), "")
+        if not isinstance(question, str):
+            raise ValueError(f"Line {line_no} has a question that is not a string.")
+        if not question.strip():
+            raise ValueError(f"Line {line_no} has no question.")
+
+        filters = record.get("filters")
+        if filters is not None:
+            if not isinstance(filters, dict):
+                raise ValueError(f"Line {line_no} has filters that are not a JSON object.")
+            try:
+                filters = RetrievalFilters(**filters).model_dump(exclude_none=True)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Line {line_no} has invalid filters: {e}")
+
+        question = question.strip()
+        item_id = next((record[k] for k in ID_FIELDS if record.get(k) is not None), None)
+        if item_id is None:
+            item_id = _content_id(question, filters)
+        elif not isinstance(item_id, (str, int)) or isinstance(item_id, bool):
+            raise ValueError(f"Line {line_no} has an id that is not a string or integer.")
+        item_id = str(item_id)
+        if item_id in seen_ids:
+            raise ValueError(f"Line {line_no} repeats id '{item_id}'.")
+        seen_ids.add(item_id)
+
+        items.append({"id": item_id, "question": question, "filters": filters})
+    return items
+
+
+def _content_id(question: str, filters: Optional[Dict]) -> str:
+    """Stable id for a line without one, derived from what is being asked."""
+    key = json.dumps({"question": question, "filters": filters}, sort_keys=True, ensure_ascii=False)
+    return f"q-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
+
+
+def positive_int(value: str) -> int:
+    """argparse type for options that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+
+def _answer_one(item: Dict, retrieved_chunks: List[Dict[str, str]]) -> Dict:
+    try:
+        answer = generate_with_groq(item["question"], retrieved_chunks=retrieved_chunks)
+        return {"id": item["id"], "question": item["question"], "answer": answer}
+    except Exception as e:
+        return {"id": item["id"], "question": item["question"], "error": str(e)}
+
+
+def iter_batch_answers(
+    items: List[Dict],
+    top_k: int = DEFAULT_TOP_K,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> Iterator[Dict]:
+    """
+    Answers question items, yielding one result dict per item as soon as it
+    is ready. Retrieval is done per batch with a single embedding call and
+    one FAISS search per shard; LLM calls run on a bounded thread pool.
+    A failing item yields {"id", "question", "error"} instead of stopping the run.
+    """
+    rag_manager = get_rag_manager()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            try:
+                batch_chunks = rag_manager.batch_retrieve(
+                    [item["question"] for item in batch],
+                    top_k=top_k,
+                    filters=[item.get("filters") for item in batch],
+                )
+            except Exception as e:
+                for item in batch:
+                    yield {"id": item["id"], "question": item["question"], "error": str(e)}
+                continue
+
+            futures = [executor.submit(_answer_one, item, chunks) for item, chunks in zip(batch, batch_chunks)]
+            for future in as_completed(futures):
+                yield future.result()
+    finally:
+        # If the consumer stops early (e.g. the HTTP client disconnects), drop
+        # queued LLM calls instead of waiting for the whole batch to finish.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def load_completed(output_path: str) -> Set[Tuple[str, str]]:
+    """
+    Returns the (id, question) pairs that already have a successful answer in
+    the output file. Matching on the question too means an id that now points
+    at a different question is answered again rather than skipped.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                continue
+            if "answer" in record and "error" not in record:
+                completed.add((str(record.get("id")), record.get("question")))
+    return completed
+
+
+def compact_output(output_path: str):
+    """
+    Rewrites the output file so it holds exactly one result per id: the last
+    one written. This drops error lines that a later rerun has superseded.
+    """
+    latest: Dict[str, str] = {}
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # Re-inserting moves the id to the end, keeping results in answer order
+            key = str(record.get("id"))
+            latest.pop(key, None)
+            latest[key] = line if line.endswith("\n") else line + "\n"
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(latest.values())
+    os.replace(tmp_path, output_path)
+
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    top_k: int = DEFAULT_TOP_K,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> Dict:
+    """
+    Answers every question in input_path and appends the results to
+    output_path as JSONL. Questions already answered in output_path are
+    skipped, so an interrupted or partially failed run can simply be rerun.
+    Once the run finishes the file is compacted to one result per id.
+    Returns a summary with counts and throughput.
+    """
+    with open(input_path, "r", encoding="utf-8") as f:
+        items = parse_questions(f)
+    completed = load_completed(output_path)
+    pending = [item for item in items if (item["id"], item["question"]) not in completed]
+    print(f"📄 {len(items)} questions, {len(items) - len(pending)} already answered, {len(pending)} to go.")
+
+    answered = failed = 0
+    started = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out:
+        for result in iter_batch_answers(pending, top_k=top_k, batch_size=batch_size, concurrency=concurrency):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            if "error" in result:
+                failed += 1
+            else:
+                answered += 1
+    elapsed = time.perf_counter() - started
+    compact_output(output_path)
+
+    summary = {
+        "total": len(items),
+        "skipped": len(items) - len(pending),
+        "answered": answered,
+        "failed": failed,
+        "elapsed_seconds": round(elapsed, 2),
+        "questions_per_second": round((answered + failed) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    return summary
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of legal questions in bulk.")
+    parser.add_argument("input", help="JSONL file with one {\"id\", \"question\", \"filters\"} object per line; ids must be unique.")
+    parser.add_argument("output", help="JSONL file for answers. Existing answers are skipped on rerun; the file keeps one result per id.")
+    parser.add_argument("--top-k", type=positive_int, default=DEFAULT_TOP_K)
+    parser.add_argument("--batch-size", type=positive_int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=positive_int, default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    print("🚀 Starting batch run...")
+    summary = run_batch(args.input, args.output, args.top_k, args.batch_size, args.concurrency)
+    print(f"\n🎉 Batch complete: {summary['answered']} answered, {summary['failed']} failed, "
+          f"{summary['skipped']} skipped in {summary['elapsed_seconds']}s "
+          f"({summary['questions_per_second']} questions/s).")
+
+
+if __name__ == "__main__":
+    main()
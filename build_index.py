@@ -1,9 +1,18 @@
 import os
+import re
 from rag_manager import get_rag_manager
 
 # IMPORTANT: Create a 'docs' folder and place your .txt and .pdf files there.
 # This script will automatically find and index them.
 DOCS_DIRECTORY = "docs"
+# Document-level metadata stored on each shard and usable as /ask filters.
+DOCS_COLLECTION = "core"
+DOCS_JURISDICTION = "Armenia"
+
+def year_from_filename(filename: str):
+    """Picks a four-digit year such as '(2022)' out of the filename, if present."""
+    match = re.search(r"\b(1[89]\d{2}|20\d{2})\b", filename)
+    return int(match.group(1)) if match else None
 
 def main():
     """
@@ -24,13 +33,19 @@ def main():
             try:
                 with open(file_path, "rb") as f:
                     file_content = f.read()
-                rag_manager.add_document(file_content, filename)
+                rag_manager.add_document(
+                    file_content,
+                    filename,
+                    collection=DOCS_COLLECTION,
+                    jurisdiction=DOCS_JURISDICTION,
+                    year=year_from_filename(filename),
+                )
                 print(f"✅ Successfully processed and indexed '{filename}'.")
             except Exception as e:
                 print(f"❌ Error processing file {filename}: {e}")
 
     print("\n🎉 Initial indexing complete.")
-    print(f"Total vectors in index: {rag_manager.index.ntotal}")
+    print(f"Total vectors in index: {rag_manager.total_vectors}")
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,7 @@
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from llm import generate_with_groq
+from rag_manager import get_embedding_model
 
 # NOTE: The main application (`api_backend.py` and `main.py`) uses a separate,
 # more direct retrieval logic defined in the `rag_manager.py` file.
@@ -20,7 +20,8 @@ class AdvancedRAG:
             raise ValueError("Documents must be a non-empty list of strings.")
         self.documents = documents
         self.metadatas = metadatas if metadatas else [{} for _ in documents]
-        self.model = SentenceTransformer(embedding_model)
+        # Shares the process-wide model with RAGManager instead of loading a second copy.
+        self.model = get_embedding_model(embedding_model)
         self.doc_embeddings = self.model.encode(documents, convert_to_numpy=True)
         self.index = faiss.IndexFlatL2(self.doc_embeddings.shape[1])
         self.index.add(self.doc_embeddings)
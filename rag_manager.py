@@ -1,23 +1,142 @@
 import os
+import re
 import faiss
+import hashlib
 import pickle
 import threading
 import shutil
 import numpy as np
 from typing import List, Optional, Dict
+from pydantic import BaseModel
 from sentence_transformers import SentenceTransformer
 from rag_utils import smart_chunk_text, extract_text_from_file
 
 STORAGE_DIR = "storage"
-INDEX_PATH = os.path.join(STORAGE_DIR, "faiss_index.bin")
-METADATA_PATH = os.path.join(STORAGE_DIR, "metadata.pkl")
+SHARDS_DIR = os.path.join(STORAGE_DIR, "shards")
+SHARD_INDEX_FILE = "faiss_index.bin"
+SHARD_METADATA_FILE = "metadata.pkl"
+# Single flat index written by older versions; migrated into shards on load.
+LEGACY_INDEX_PATH = os.path.join(STORAGE_DIR, "faiss_index.bin")
+LEGACY_METADATA_PATH = os.path.join(STORAGE_DIR, "metadata.pkl")
+# Migrated shards are built here and only moved into SHARDS_DIR once all are saved.
+MIGRATION_STAGING_DIR = os.path.join(STORAGE_DIR, "shards.migrating")
 # Reverted to LaBSE for faster performance as requested
 EMBEDDING_MODEL = "sentence-transformers/LaBSE"
+# Local snapshot of the embedding model. Kept outside STORAGE_DIR so that
+# delete_index() does not throw away the downloaded weights.
+MODEL_CACHE_DIR = os.getenv("EMBEDDING_MODEL_DIR", "model_cache")
+WARMUP_QUERY = "warm-up"
+
+_model_cache: Dict[str, SentenceTransformer] = {}
+_model_lock = threading.Lock()
+_ready_event = threading.Event()
+_load_error: Optional[str] = None
+
+
+def get_embedding_model(model_name: str = EMBEDDING_MODEL) -> SentenceTransformer:
+    """
+    Returns a process-wide shared SentenceTransformer. The model is loaded from
+    a local snapshot when one exists, otherwise it is downloaded once and the
+    snapshot is saved so the next cold start skips the hub lookup.
+    """
+    with _model_lock:
+        if model_name in _model_cache:
+            return _model_cache[model_name]
+        snapshot_dir = os.path.join(MODEL_CACHE_DIR, model_name.replace("/", "__"))
+        model = None
+        if os.path.isdir(snapshot_dir):
+            print(f"📦 Loading embedding model from local snapshot: {snapshot_dir}")
+            try:
+                model = SentenceTransformer(snapshot_dir)
+            except Exception as e:
+                print(f"⚠️ Local snapshot is unusable ({e}). Removing it and downloading again.")
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+        if model is None:
+            print(f"⬇️ Downloading embedding model: {model_name}")
+            model = SentenceTransformer(model_name)
+            # Save into a temporary directory and move it into place, so an
+            # interrupted save never leaves a half-written snapshot behind.
+            tmp_dir = f"{snapshot_dir}.tmp-{os.getpid()}"
+            try:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                model.save(tmp_dir)
+                os.replace(tmp_dir, snapshot_dir)
+                print(f"💾 Saved model snapshot to {snapshot_dir}")
+            except Exception as e:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                print(f"⚠️ Could not save model snapshot: {e}")
+        _model_cache[model_name] = model
+        return model
+
+
+class RetrievalFilters(BaseModel):
+    """Filters understood by Shard.matches(); each one narrows the shards searched."""
+    source: Optional[List[str]] = None
+    collection: Optional[str] = None
+    jurisdiction: Optional[str] = None
+    year: Optional[int] = None
+
+
+def shard_name_for(source: str) -> str:
+    """Maps a source filename to a filesystem-safe shard name."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", source)
+
+
+class Shard:
+    """
+    A single FAISS index holding the chunks of one source document, together
+    with document-level metadata (collection, jurisdiction, year) used to
+    decide whether the shard is searched at all.
+    """
+
+    def __init__(self, name: str, index, chunk_metadata: List[Dict], info: Dict, root: str = SHARDS_DIR):
+        self.name = name
+        self.root = root
+        self.index = index
+        # chunk_metadata is a list of dicts, e.g., [{"text": str, "source": str, ...}]
+        self.chunk_metadata = chunk_metadata
+        self.info = info
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.root, self.name)
+
+    @classmethod
+    def load(cls, name: str) -> "Shard":
+        path = os.path.join(SHARDS_DIR, name)
+        index = faiss.read_index(os.path.join(path, SHARD_INDEX_FILE))
+        with open(os.path.join(path, SHARD_METADATA_FILE), "rb") as f:
+            data = pickle.load(f)
+        return cls(name, index, data.get("chunk_metadata", []), data.get("info", {}))
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        faiss.write_index(self.index, os.path.join(self.path, SHARD_INDEX_FILE))
+        with open(os.path.join(self.path, SHARD_METADATA_FILE), "wb") as f:
+            pickle.dump({"chunk_metadata": self.chunk_metadata, "info": self.info}, f)
+
+    def matches(self, filters: Optional[Dict]) -> bool:
+        """True if this shard satisfies every non-empty filter."""
+        if not filters:
+            return True
+        for key in ("source", "collection", "jurisdiction"):
+            wanted = filters.get(key)
+            if wanted is None:
+                continue
+            wanted = [wanted] if isinstance(wanted, str) else wanted
+            value = (self.info.get(key) or "").lower()
+            if value not in {w.lower() for w in wanted}:
+                return False
+        year = filters.get("year")
+        if year is not None and self.info.get("year") != year:
+            return False
+        return True
+
 
 class RAGManager:
     """
-    A thread-safe singleton to manage the RAG model, FAISS index, and
-    document processing, now with source tracking for each chunk.
+    A thread-safe singleton to manage the RAG model, the per-source FAISS
+    shards, and document processing, with source tracking for each chunk.
     """
     _instance = None
     _lock = threading.Lock()
@@ -34,46 +153,125 @@ class RAGManager:
             with self._lock:
                 if not hasattr(self, 'initialized'):
                     print("🚀 Initializing RAG Manager...")
-                    os.makedirs(STORAGE_DIR, exist_ok=True)
-                    self.model = SentenceTransformer(EMBEDDING_MODEL)
+                    os.makedirs(SHARDS_DIR, exist_ok=True)
+                    self.model = get_embedding_model(EMBEDDING_MODEL)
+                    self.embedding_dim = self.model.get_sentence_embedding_dimension()
                     self._load_data()
                     self.initialized = True
                     print("✅ RAG Manager Initialized.")
 
+    @property
+    def total_vectors(self) -> int:
+        """Total number of vectors across all shards."""
+        return sum(shard.index.ntotal for shard in self.shards.values())
+
     def _load_data(self):
-        """Loads the FAISS index and chunk metadata from storage."""
-        print("Attempting to load index and metadata...")
+        """Loads every shard from storage, then migrates a legacy flat index if one is left."""
+        print("Attempting to load shards...")
+        self.shards: Dict[str, Shard] = {}
+        for name in sorted(os.listdir(SHARDS_DIR)):
+            try:
+                self.shards[name] = Shard.load(name)
+            except Exception as e:
+                print(f"❌ Error loading shard '{name}': {e}. Skipping it.")
+        if os.path.exists(LEGACY_INDEX_PATH) and os.path.exists(LEGACY_METADATA_PATH):
+            self._migrate_legacy_index()
+        if self.shards:
+            print(f"✅ Loaded {len(self.shards)} shards with {self.total_vectors} vectors.")
+        else:
+            print("⚠️ No existing shards found. Starting with an empty knowledge base.")
+
+    def _migrate_legacy_index(self):
+        """
+        Splits the old single flat index into one shard per source. Shards are
+        built in a staging directory and moved into place only after all of
+        them are saved; sources that already have a shard (from an earlier,
+        interrupted migration) are skipped. Raises RuntimeError on failure so
+        a partial knowledge base is never served.
+        """
+        print("🔄 Migrating legacy flat index into per-source shards...")
+        shutil.rmtree(MIGRATION_STAGING_DIR, ignore_errors=True)
         try:
-            if os.path.exists(INDEX_PATH) and os.path.exists(METADATA_PATH):
-                self.index = faiss.read_index(INDEX_PATH)
-                with open(METADATA_PATH, "rb") as f:
-                    # Metadata now contains chunks with their sources
-                    self.chunk_metadata = pickle.load(f).get("chunk_metadata", [])
-                print(f"✅ Loaded existing index with {self.index.ntotal} vectors.")
-            else:
-                self._initialize_new_index()
+            index = faiss.read_index(LEGACY_INDEX_PATH)
+            with open(LEGACY_METADATA_PATH, "rb") as f:
+                chunk_metadata = pickle.load(f).get("chunk_metadata", [])
+            vectors = index.reconstruct_n(0, index.ntotal)
+            by_source: Dict[str, List[int]] = {}
+            for i, meta in enumerate(chunk_metadata[:index.ntotal]):
+                by_source.setdefault(meta.get("source", "unknown"), []).append(i)
+
+            staged = []
+            for source, ids in by_source.items():
+                if self._find_shard(source) is not None:
+                    print(f"Skipping '{source}': already migrated.")
+                    continue
+                shard = self._new_shard(source, root=MIGRATION_STAGING_DIR)
+                shard.index.add(vectors[ids])
+                shard.chunk_metadata = [chunk_metadata[i] for i in ids]
+                shard.save()
+                staged.append(shard)
+
+            for shard in staged:
+                os.replace(shard.path, os.path.join(SHARDS_DIR, shard.name))
+                shard.root = SHARDS_DIR
+                self.shards[shard.name] = shard
+            os.remove(LEGACY_INDEX_PATH)
+            os.remove(LEGACY_METADATA_PATH)
+            shutil.rmtree(MIGRATION_STAGING_DIR, ignore_errors=True)
+            print(f"✅ Migrated {sum(s.index.ntotal for s in staged)} vectors into {len(staged)} shards.")
+            print("⚠️ Migrated shards have no collection/jurisdiction/year; set them via update_shard_info().")
         except Exception as e:
-            print(f"❌ Error loading data: {e}. Initializing a fresh index.")
-            self._initialize_new_index()
-
-    def _initialize_new_index(self):
-        """Initializes a new, empty FAISS index and metadata list."""
-        print("⚠️ No existing index found. Initializing a new one.")
-        embedding_dim = self.model.get_sentence_embedding_dimension()
-        self.index = faiss.IndexFlatL2(embedding_dim)
-        # chunk_metadata will be a list of dicts, e.g., [{"text": str, "source": str}]
-        self.chunk_metadata = []
-
-    def _save_data(self):
-        """Saves the current index and chunk metadata to disk."""
-        print("💾 Saving index and metadata...")
-        faiss.write_index(self.index, INDEX_PATH)
-        with open(METADATA_PATH, "wb") as f:
-            pickle.dump({"chunk_metadata": self.chunk_metadata}, f)
-        print("✅ Data saved successfully.")
-
-    def add_document(self, file_content: bytes, filename: str):
-        """Adds a new document to the knowledge base, tracking chunk sources."""
+            shutil.rmtree(MIGRATION_STAGING_DIR, ignore_errors=True)
+            print(f"❌ Error migrating legacy index: {e}. Leaving it in place.")
+            raise RuntimeError(f"Legacy index migration failed: {e}") from e
+
+    def _new_shard(self, source: str, collection: Optional[str] = None,
+                   jurisdiction: Optional[str] = None, year: Optional[int] = None,
+                   root: str = SHARDS_DIR) -> Shard:
+        """Creates a new, empty shard for a source document, to be saved under `root`."""
+        info = {"source": source, "collection": collection, "jurisdiction": jurisdiction, "year": year}
+        name = shard_name_for(source)
+        taken = name in self.shards or any(os.path.exists(os.path.join(d, name)) for d in {SHARDS_DIR, root})
+        if taken:
+            # Another source sanitises to the same name, e.g. "a b.pdf" and "a_b.pdf"
+            name = f"{name}-{hashlib.sha1(source.encode('utf-8')).hexdigest()[:8]}"
+        return Shard(name, faiss.IndexFlatL2(self.embedding_dim), [], info, root=root)
+
+    def _find_shard(self, source: str) -> Optional[Shard]:
+        """Returns the shard holding `source`, matched on the stored source name."""
+        for shard in self.shards.values():
+            if shard.info.get("source") == source:
+                return shard
+        return None
+
+    @staticmethod
+    def _apply_info(shard: Shard, collection: Optional[str], jurisdiction: Optional[str],
+                    year: Optional[int]) -> bool:
+        """Overwrites shard metadata with the given non-None values. Returns True if anything changed."""
+        updates = {"collection": collection, "jurisdiction": jurisdiction, "year": year}
+        updates = {k: v for k, v in updates.items() if v is not None and shard.info.get(k) != v}
+        shard.info.update(updates)
+        return bool(updates)
+
+    def update_shard_info(self, name: str, collection: Optional[str] = None,
+                          jurisdiction: Optional[str] = None, year: Optional[int] = None) -> bool:
+        """
+        Sets document-level metadata on an existing shard without re-embedding it,
+        e.g. for shards migrated from the legacy index, which start with none.
+        Returns False if the shard does not exist.
+        """
+        with self._lock:
+            shard = self.shards.get(name)
+            if shard is None:
+                return False
+            if self._apply_info(shard, collection, jurisdiction, year):
+                shard.save()
+                print(f"✅ Updated metadata for shard '{name}': {shard.info}")
+            return True
+
+    def add_document(self, file_content: bytes, filename: str, collection: Optional[str] = None,
+                     jurisdiction: Optional[str] = None, year: Optional[int] = None):
+        """Adds a new document to its own shard, tracking chunk sources."""
         with self._lock:
             print(f"🔄 Processing document: {filename}")
             text = extract_text_from_file(file_content, filename)
@@ -85,38 +283,118 @@ class RAGManager:
             if not new_chunks_text:
                 return
 
+            shard = self._find_shard(filename)
+            if shard is None:
+                shard = self._new_shard(filename, collection, jurisdiction, year)
+            else:
+                self._apply_info(shard, collection, jurisdiction, year)
+            name = shard.name
             # Create metadata for each new chunk
             new_metadata = [{"text": chunk, "source": filename} for chunk in new_chunks_text]
 
             print(f"Embedding {len(new_chunks_text)} chunks for {filename}...")
             new_embeddings = self.model.encode(new_chunks_text, convert_to_numpy=True, show_progress_bar=True)
 
-            self.index.add(new_embeddings)
-            self.chunk_metadata.extend(new_metadata)
-            self._save_data()
-            print(f"✅ Successfully added {filename}. Total vectors: {self.index.ntotal}")
+            shard.index.add(new_embeddings)
+            shard.chunk_metadata.extend(new_metadata)
+            print(f"💾 Saving shard '{name}'...")
+            shard.save()
+            self.shards[name] = shard
+            print(f"✅ Successfully added {filename}. Total vectors: {self.total_vectors}")
+
+    def list_shards(self) -> List[Dict]:
+        """Returns the document-level metadata and size of every shard."""
+        return [
+            {"name": shard.name, "vector_count": shard.index.ntotal, **shard.info}
+            for shard in self.shards.values()
+        ]
 
-    def retrieve(self, query: str, top_k: int = 15, score_threshold: Optional[float] = None) -> List[Dict[str, str]]:
+    def retrieve(self, query: str, top_k: int = 15, score_threshold: Optional[float] = None,
+                 filters: Optional[Dict] = None) -> List[Dict[str, str]]:
         """
         Retrieves the most relevant document chunks for a given query,
-        returning both the text and its source metadata.
+        returning both the text and its source metadata. Only shards matching
+        `filters` (source, collection, jurisdiction, year) are searched; the
+        per-shard hits are merged by distance.
         """
-        if self.index.ntotal == 0:
+        shards = [s for s in list(self.shards.values()) if s.index.ntotal > 0 and s.matches(filters)]
+        if not shards:
             return []
-            
+
         query_vec = self.model.encode([query], convert_to_numpy=True)
-        distances, indices = self.index.search(query_vec, top_k)
-        
+        hits = []
+        for shard in shards:
+            distances, indices = shard.index.search(query_vec, min(top_k, shard.index.ntotal))
+            for dist, idx in zip(distances[0], indices[0]):
+                if 0 <= idx < len(shard.chunk_metadata):
+                    hits.append((dist, shard.chunk_metadata[idx]))
+
+        hits.sort(key=lambda hit: hit[0])
         results = []
-        for dist, idx in zip(distances[0], indices[0]):
+        for dist, meta in hits[:top_k]:
             if score_threshold is None or dist <= score_threshold:
-                if idx < len(self.chunk_metadata):
-                    results.append(self.chunk_metadata[idx])
-        
+                results.append(meta)
+
         return results
 
+    def batch_retrieve(self, queries: List[str], top_k: int = 15, score_threshold: Optional[float] = None,
+                       filters: Optional[List[Optional[Dict]]] = None) -> List[List[Dict[str, str]]]:
+        """
+        Batched version of retrieve(): all queries are encoded in one call and
+        each shard is searched once with every query whose filters select it.
+        `filters`, if given, holds one filter dict (or None) per query.
+        """
+        if not queries:
+            return []
+        filters = filters or [None] * len(queries)
+        query_vecs = self.model.encode(queries, convert_to_numpy=True)
+        hits: List[List] = [[] for _ in queries]
+        for shard in list(self.shards.values()):
+            if shard.index.ntotal == 0:
+                continue
+            selected = [i for i, f in enumerate(filters) if shard.matches(f)]
+            if not selected:
+                continue
+            distances, indices = shard.index.search(query_vecs[selected], min(top_k, shard.index.ntotal))
+            for row, qi in enumerate(selected):
+                for dist, idx in zip(distances[row], indices[row]):
+                    if 0 <= idx < len(shard.chunk_metadata):
+                        hits[qi].append((dist, shard.chunk_metadata[idx]))
+
+        batch_results = []
+        for query_hits in hits:
+            query_hits.sort(key=lambda hit: hit[0])
+            batch_results.append([
+                meta for dist, meta in query_hits[:top_k]
+                if score_threshold is None or dist <= score_threshold
+            ])
+        return batch_results
+
+    def warm_up(self):
+        """
+        Primes the encoder and the index so the first real request does not pay
+        for lazy initialisation (kernel setup, tokenizer caches, index pages).
+        """
+        print("🔥 Warming up encoder and index...")
+        query_vec = self.model.encode([WARMUP_QUERY], convert_to_numpy=True)
+        for shard in list(self.shards.values()):
+            if shard.index.ntotal > 0:
+                shard.index.search(query_vec, min(10, shard.index.ntotal))
+        print("✅ Warm-up complete.")
+
+    def delete_shard(self, name: str) -> bool:
+        """Deletes a single shard from memory and disk. Returns False if it does not exist."""
+        with self._lock:
+            shard = self.shards.pop(name, None)
+            if shard is None:
+                return False
+            print(f"🗑️ Deleting shard '{name}'...")
+            shutil.rmtree(shard.path, ignore_errors=True)
+            print(f"✅ Shard '{name}' removed. Total vectors: {self.total_vectors}")
+            return True
+
     def delete_index(self):
-        """Deletes the entire FAISS index and metadata from disk."""
+        """Deletes every shard and all metadata from disk."""
         with self._lock:
             print("🗑️ Deleting existing index and metadata...")
             if os.path.exists(STORAGE_DIR):
@@ -126,11 +404,49 @@ class RAGManager:
                 except OSError as e:
                     print(f"❌ Error removing storage directory: {e}")
             
-            os.makedirs(STORAGE_DIR, exist_ok=True)
-            self._initialize_new_index()
+            os.makedirs(SHARDS_DIR, exist_ok=True)
+            self.shards = {}
             print("✨ A new, empty index has been initialized.")
 
 
 def get_rag_manager():
     """Factory function to get the RAGManager instance."""
-    return RAGManager()
\ No newline at end of file
+    return RAGManager()
+
+
+def _load_and_warm_up():
+    """Builds the RAGManager, warms it up and marks the process as ready."""
+    global _load_error
+    try:
+        get_rag_manager().warm_up()
+        _load_error = None
+        _ready_event.set()
+    except Exception as e:
+        _load_error = str(e)
+        print(f"❌ Error loading RAG Manager: {e}")
+
+
+def load_rag_manager(background: bool = False):
+    """
+    Loads and warms up the RAGManager. With background=True the work runs in a
+    daemon thread and this call returns immediately; use is_rag_ready() to
+    find out when the manager can serve requests.
+    """
+    if _ready_event.is_set():
+        return
+    if background:
+        threading.Thread(target=_load_and_warm_up, name="rag-loader", daemon=True).start()
+    else:
+        _load_and_warm_up()
+        if _load_error:
+            raise RuntimeError(_load_error)
+
+
+def is_rag_ready() -> bool:
+    """True once the RAGManager has been loaded and warmed up."""
+    return _ready_event.is_set()
+
+
+def get_rag_load_error() -> Optional[str]:
+    """Returns the last load error, if the background load failed."""
+    return _load_error
\ No newline at end of file